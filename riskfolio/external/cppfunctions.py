@@ -6,6 +6,7 @@ This work is licensed under BSD 3-Clause "New" or "Revised" License.
 License available at https://github.com/dcajasn/Riskfolio-Lib/blob/master/LICENSE.txt
 """
 
+import os
 import numpy as np
 import pandas as pd
 from riskfolio.external.functions import *
@@ -274,7 +275,7 @@ def d_corr(X, Y):
     return value
 
 
-def d_corr_matrix(Y):
+def d_corr_matrix(Y, n_threads=None):
     r"""
     Calculates the distance correlation matrix of matrix of variables Y.
 
@@ -282,6 +283,9 @@ def d_corr_matrix(Y):
     ----------
     Y : ndarray or dataframe
         Returns series of shape n_sample x n_features.
+    n_threads : int, optional
+        Number of threads used to calculate the matrix. The default is None,
+        which uses the number of CPUs given by os.cpu_count().
 
     Returns
     -------
@@ -293,7 +297,10 @@ def d_corr_matrix(Y):
         ValueError when the value cannot be calculated.
 
     """
+    if n_threads is None:
+        n_threads = os.cpu_count() or 1
+
     Y_ = np.array(Y, ndmin=2)
-    value = cpp_dcorr_matrix(Y_)
+    value = cpp_dcorr_matrix(Y_, n_threads)
 
     return value
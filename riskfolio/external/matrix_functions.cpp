@@ -6,6 +6,12 @@
  */
 
 #include <iostream>
+#include <algorithm>
+#include <atomic>
+#include <cmath>
+#include <numeric>
+#include <thread>
+#include <vector>
 #include <Eigen>
 #include <Eigen/Core>
 #include <Eigen/KroneckerProduct>
@@ -213,12 +219,13 @@ Eigen::MatrixXd cpp_pdist(Eigen::MatrixXd& X) {
 }
 
 /**
- * Calculates the distance correlation of matrices X and Y.
+ * Calculates the distance correlation of matrices X and Y using their
+ * euclidean distance matrices, it requires O(n^2) time and memory.
  * 
  * @X A matrix.
  * @Y A matrix.
  */
-double cpp_dcorr(Eigen::MatrixXd X, Eigen::MatrixXd Y){
+double cpp_dcorr_pdist(Eigen::MatrixXd X, Eigen::MatrixXd Y){
     Eigen::MatrixXd a = cpp_pdist(X);
     Eigen::MatrixXd b = cpp_pdist(Y);
 
@@ -239,21 +246,196 @@ double cpp_dcorr(Eigen::MatrixXd X, Eigen::MatrixXd Y){
     return value;
 }
 
+/**
+ * Sorting order, ranks, distance row sums and distance variance of a
+ * univariate variable, they are shared by all the pairs in which the
+ * variable is used.
+ */
+struct DcorrColumn {
+    Eigen::VectorXd x;
+    std::vector<int> order;
+    std::vector<int> rank;
+    Eigen::VectorXd row_sums;
+    double dcov2;
+};
+
+/**
+ * Calculates the statistics of a univariate variable x used by the fast
+ * distance covariance algorithm of Huo, X., & Székely, G. J. (2016). Fast
+ * Computing for Distance Covariance. Technometrics, 58(4), 435–447.
+ * https://doi.org/10.1080/00401706.2015.1054435
+ *
+ * @x A vector.
+ */
+DcorrColumn cpp_dcorr_column(const Eigen::VectorXd& x){
+    int n = x.size();
+    DcorrColumn col;
+    // Distances are shift invariant, centering reduces rounding errors
+    col.x = x.array() - x.mean();
+
+    col.order.resize(n);
+    std::iota(col.order.begin(), col.order.end(), 0);
+    std::stable_sort(col.order.begin(), col.order.end(),
+        [&col](int a, int b) { return col.x(a) < col.x(b); });
+
+    col.rank.resize(n);
+    for (int t = 0; t < n; ++t) {
+        col.rank[col.order[t]] = t + 1;
+    }
+
+    // Row sums of |x_i - x_j| using the prefix sums of the sorted values
+    double total = col.x.sum();
+    double prefix = 0.0;
+    col.row_sums.resize(n);
+    for (int t = 0; t < n; ++t) {
+        int k = col.order[t];
+        col.row_sums(k) = (2.0 * t - n) * col.x(k) + total - 2.0 * prefix;
+        prefix += col.x(k);
+    }
+
+    // sum of |x_i - x_j|^2 over all i, j
+    double s1 = 2.0 * n * col.x.squaredNorm() - 2.0 * total * total;
+    double s2 = col.row_sums.squaredNorm();
+    double s3 = col.row_sums.sum() * col.row_sums.sum();
+    col.dcov2 = s1 / std::pow(n, 2) - 2.0 * s2 / std::pow(n, 3) + s3 / std::pow(n, 4);
+
+    return col;
+}
+
+/**
+ * Calculates the squared distance covariance (V-statistic) of two
+ * univariate variables in O(n log n) time. The sum of products of
+ * distances is computed scanning the observations in the order of a
+ * and accumulating the observations with lower values of b in four
+ * Fenwick trees.
+ *
+ * @a Statistics of the first variable.
+ * @b Statistics of the second variable.
+ */
+double cpp_dcov2_fast(const DcorrColumn& a, const DcorrColumn& b){
+    int n = a.x.size();
+    std::vector<double> t_c(n + 1, 0.0), t_x(n + 1, 0.0), t_y(n + 1, 0.0), t_xy(n + 1, 0.0);
+    double all_c = 0.0, all_x = 0.0, all_y = 0.0, all_xy = 0.0;
+    double s1 = 0.0;
+
+    for (int t = 0; t < n; ++t) {
+        int k = a.order[t];
+        double xi = a.x(k);
+        double yi = b.x(k);
+        int r = b.rank[k];
+
+        double lo_c = 0.0, lo_x = 0.0, lo_y = 0.0, lo_xy = 0.0;
+        for (int q = r - 1; q > 0; q -= q & -q) {
+            lo_c += t_c[q];
+            lo_x += t_x[q];
+            lo_y += t_y[q];
+            lo_xy += t_xy[q];
+        }
+
+        // sum over previous j of sign(y_i - y_j) * (x_i - x_j) * (y_i - y_j)
+        s1 += xi * yi * (2.0 * lo_c - all_c) - xi * (2.0 * lo_y - all_y)
+            - yi * (2.0 * lo_x - all_x) + (2.0 * lo_xy - all_xy);
+
+        for (int q = r; q <= n; q += q & -q) {
+            t_c[q] += 1.0;
+            t_x[q] += xi;
+            t_y[q] += yi;
+            t_xy[q] += xi * yi;
+        }
+        all_c += 1.0;
+        all_x += xi;
+        all_y += yi;
+        all_xy += xi * yi;
+    }
+    s1 *= 2.0;
+
+    double s2 = a.row_sums.dot(b.row_sums);
+    double s3 = a.row_sums.sum() * b.row_sums.sum();
+    double dcov2 = s1 / std::pow(n, 2) - 2.0 * s2 / std::pow(n, 3) + s3 / std::pow(n, 4);
+
+    return std::max(dcov2, 0.0);
+}
+
+/**
+ * Calculates the distance correlation of two univariate variables.
+ *
+ * @a Statistics of the first variable.
+ * @b Statistics of the second variable.
+ */
+double cpp_dcorr_fast(const DcorrColumn& a, const DcorrColumn& b){
+    double dcov2_xy = cpp_dcov2_fast(a, b);
+    double value = std::sqrt(dcov2_xy) / std::sqrt(std::sqrt(a.dcov2) * std::sqrt(b.dcov2));
+
+    return value;
+}
+
+/**
+ * Calculates the distance correlation of matrices X and Y. When X and Y
+ * have one column it uses the O(n log n) algorithm for univariate
+ * variables.
+ *
+ * @X A matrix.
+ * @Y A matrix.
+ */
+double cpp_dcorr(Eigen::MatrixXd X, Eigen::MatrixXd Y){
+    if (X.cols() == 1 && Y.cols() == 1) {
+        return cpp_dcorr_fast(cpp_dcorr_column(X.col(0)), cpp_dcorr_column(Y.col(0)));
+    }
+
+    return cpp_dcorr_pdist(X, Y);
+}
+
+/**
+ * Runs f(k) for k = 0, ..., n_tasks - 1 using n_threads threads. Tasks
+ * are assigned dynamically in increasing order of k.
+ *
+ * @n_tasks number of tasks.
+ * @n_threads number of threads.
+ * @f function that runs task k.
+ */
+template <typename F>
+void cpp_parallel_for(const int &n_tasks, int n_threads, F f) {
+    n_threads = std::max(1, std::min(n_threads, n_tasks));
+    std::atomic<int> next(0);
+    auto worker = [&]() {
+        for (int k = next++; k < n_tasks; k = next++) {
+            f(k);
+        }
+    };
+
+    std::vector<std::thread> threads;
+    for (int t = 1; t < n_threads; ++t) {
+        threads.emplace_back(worker);
+    }
+    worker();
+    for (auto& thread : threads) {
+        thread.join();
+    }
+}
+
 /**
  * Calculates the distance correlation matrix of a matrix of variables Y.
  * 
  * @Y A matrix which each column represents a variable.
+ * @n_threads number of threads used to calculate the matrix.
  */
-Eigen::MatrixXd cpp_dcorr_matrix(Eigen::MatrixXd Y){
+Eigen::MatrixXd cpp_dcorr_matrix(Eigen::MatrixXd Y, const int &n_threads=1){
     int n = Y.cols();
     Eigen::MatrixXd corr = Eigen::MatrixXd::Ones(n,n);
 
-    for (int i = 0; i < n; ++i) {
+    std::vector<DcorrColumn> cols(n);
+    cpp_parallel_for(n, n_threads, [&](int i) {
+        cols[i] = cpp_dcorr_column(Y.col(i));
+    });
+
+    // Each task is a row of the upper triangle, each element of corr is
+    // written by only one thread
+    cpp_parallel_for(n, n_threads, [&](int i) {
         for (int j = i+1; j < n; ++j) {
-            corr(i, j) = cpp_dcorr(Y.col(i), Y.col(j));
+            corr(i, j) = cpp_dcorr_fast(cols[i], cols[j]);
             corr(j, i) = corr(i, j);
         }
-    }
+    });
 
     return corr;
 }
@@ -454,13 +636,17 @@ void bind_dcorr_matrix(py::module &m) {
             ----------
             Y : ndarray
                 A matrix of variables.
+            n_threads : int
+                Number of threads used to calculate the matrix.
 
             Returns
             -------
             corr: ndarray
                 Distance correlation matrix.
         )pbdoc",
-        py::arg("Y")
+        py::arg("Y"),
+        py::arg("n_threads")=1,
+        py::call_guard<py::gil_scoped_release>()
     );
 }
 
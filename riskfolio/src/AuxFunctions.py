@@ -6,6 +6,7 @@ This work is licensed under BSD 3-Clause "New" or "Revised" License.
 License available at https://github.com/dcajasn/Riskfolio-Lib/blob/master/LICENSE.txt
 """
 
+import math
 import numpy as np
 import pandas as pd
 import matplotlib as mpl
@@ -13,15 +14,17 @@ import matplotlib.pyplot as plt
 import scipy.stats as st
 import scipy.cluster.hierarchy as hr
 from scipy import linalg as LA
+from scipy.linalg.blas import dtrmm
 from statsmodels.stats.correlation_tools import cov_nearest
 from scipy.sparse import csr_matrix
-from scipy.spatial.distance import pdist, squareform
-from scipy.optimize import minimize
-from sklearn.metrics import mutual_info_score
+from scipy.optimize import minimize_scalar
+from scipy.signal import fftconvolve
 from sklearn.neighbors import KernelDensity
 from sklearn.metrics import silhouette_samples
 from astropy.stats import knuth_bin_width, freedman_bin_width, scott_bin_width
 from itertools import product
+from functools import lru_cache
+from collections import namedtuple
 import riskfolio.external.cppfunctions as cf
 import riskfolio.src.GerberStatistic as gs
 import re
@@ -82,8 +85,24 @@ def is_pos_def(cov, threshold=1e-8):
 
     """
     cov_ = np.array(cov, ndmin=2)
-    w = LA.eigh(cov_, lower=True, check_finite=True, eigvals_only=True)
-    value = np.all(w >= threshold)
+
+    # Cholesky factorization only exists if all eigenvalues of
+    # cov_ - threshold * I are positive, it is faster than eigh
+    try:
+        LA.cholesky(
+            cov_ - threshold * np.eye(cov_.shape[0]), lower=True, check_finite=True
+        )
+        value = True
+    except LA.LinAlgError:
+        # only calculate the eigenvalues lower or equal than threshold
+        w = LA.eigh(
+            cov_,
+            lower=True,
+            check_finite=True,
+            eigvals_only=True,
+            subset_by_value=[-np.inf, threshold],
+        )
+        value = np.all(w >= threshold)
 
     return value
 
@@ -114,9 +133,11 @@ def cov2corr(cov):
         cols = cov.columns.tolist()
         flag = True
 
-    cov1 = np.array(cov, ndmin=2)
+    cov1 = np.atleast_2d(np.asarray(cov))
     std = np.sqrt(np.diag(cov1))
-    corr = np.clip(cov1 / np.outer(std, std), a_min=-1.0, a_max=1.0)
+    corr = cov1 / std[:, None]
+    corr /= std[None, :]
+    np.clip(corr, a_min=-1.0, a_max=1.0, out=corr)
 
     if flag:
         corr = pd.DataFrame(corr, index=cols, columns=cols)
@@ -155,7 +176,10 @@ def corr2cov(corr, std):
         cols = corr.columns.tolist()
         flag = True
 
-    cov = corr * np.outer(std, std)
+    corr1 = np.asarray(corr)
+    std1 = np.asarray(std).flatten()
+    cov = corr1 * std1[:, None]
+    cov *= std1[None, :]
 
     if flag:
         cov = pd.DataFrame(cov, index=cols, columns=cols)
@@ -163,6 +187,33 @@ def corr2cov(corr, std):
     return cov
 
 
+def _cov2corr_inplace(cov, out=None):
+    r"""
+    Same as cov2corr for an ndarray, but the correlation matrix is written in
+    out, which can be cov itself, instead of a new array.
+    """
+
+    std = np.sqrt(np.diag(cov))
+    out = np.divide(cov, std[:, None], out=out)
+    out /= std[None, :]
+    np.clip(out, a_min=-1.0, a_max=1.0, out=out)
+
+    return out
+
+
+def _corr2cov_inplace(corr, std, out=None):
+    r"""
+    Same as corr2cov for an ndarray, but the covariance matrix is written in
+    out, which can be corr itself, instead of a new array.
+    """
+
+    std = np.asarray(std).flatten()
+    out = np.multiply(corr, std[:, None], out=out)
+    out *= std[None, :]
+
+    return out
+
+
 def cov_fix(cov, method="clipped", threshold=1e-8):
     r"""
     Fix a covariance matrix to a positive definite matrix.
@@ -225,18 +276,19 @@ def cov_returns(cov, seed=0):
 
     rs = np.random.RandomState(seed)
     n = len(cov)
-    a = np.array(rs.randn(n + 10, n), ndmin=2)
+    a = np.array(rs.standard_normal((n + 10, n)), ndmin=2)
+    a -= np.mean(a, axis=0)
 
-    for i in range(0, 5):
-        cov_ = np.cov(a.T)
-        L = np.array(np.linalg.cholesky(cov_), ndmin=2)
-        a = a @ np.linalg.inv(L).T
-        cov_ = np.cov(a.T)
-        desv_ = np.sqrt(np.array(np.diag(cov_), ndmin=2))
-        a = (np.array(a) - np.mean(a, axis=0)) / np.array(desv_)
+    # Whitening: the left singular vectors of the centered samples are
+    # orthonormal, so U @ Vt has a sample covariance equal to the identity
+    # matrix after scaling by the number of degrees of freedom.
+    U, S, Vt = np.linalg.svd(a, full_matrices=False)
+    a = U @ Vt * np.sqrt(n + 10 - 1)
 
-    L1 = np.array(np.linalg.cholesky(cov), ndmin=2)
-    a = a @ L1.T
+    L1, _ = LA.cho_factor(np.array(cov, ndmin=2, dtype=float), lower=True)
+    # a @ L1.T as a triangular matrix product, the upper triangle of L1 is
+    # not referenced
+    a = dtrmm(1.0, L1, a, side=1, lower=1, trans_a=1)
 
     return a
 
@@ -267,22 +319,23 @@ def block_vec_pq(A, p, q):
     """
     if isinstance(A, pd.DataFrame):
         A_ = A.to_numpy()
+    else:
+        A_ = np.asarray(A)
 
     mp, nq = A_.shape
     if mp % p == 0 and nq % q == 0:
         m = int(mp / p)
         n = int(nq / q)
-        bvec_A = np.empty((0, p * q))
-        for j in range(n):
-            Aj = np.empty((0, p * q))
-            for i in range(m):
-                Aij = (
-                    A_[i * p : (i + 1) * p, j * q : (j + 1) * q]
-                    .reshape(-1, 1, order="F")
-                    .T
-                )
-                Aj = np.vstack([Aj, Aij])
-            bvec_A = np.vstack([bvec_A, Aj])
+        # Axes of A_ as (i, a, j, b) where block (i, j) has rows a and
+        # columns b, each block is stacked by columns (Fortran order) and
+        # blocks are stacked first by i and then by j. The 4d array is a
+        # view of A_ (or of A_.T if A_ is in Fortran order), so the last
+        # reshape is the only copy.
+        if A_.flags["F_CONTIGUOUS"] and not A_.flags["C_CONTIGUOUS"]:
+            A4 = A_.T.reshape(n, q, m, p).transpose(0, 2, 1, 3)
+        else:
+            A4 = A_.reshape(m, p, n, q).transpose(2, 0, 3, 1)
+        bvec_A = A4.reshape(n * m, q * p)
     else:
         raise ValueError(
             "Dimensions p and q give non integer values for dimensions m and n."
@@ -363,14 +416,12 @@ def dcorr_matrix(X):
         X1 = X.to_numpy()
         flag = True
     else:
-        X1 = X.copy()
+        X1 = np.asarray(X)
 
     corr = cf.d_corr_matrix(X1)
 
     if flag:
-        corr = pd.DataFrame(corr, index=cols, columns=cols)
-    else:
-        corr = pd.DataFrame(corr)
+        corr = pd.DataFrame(corr, index=cols, columns=cols, copy=False)
 
     return corr
 
@@ -415,6 +466,138 @@ def numBins(n_samples, corr=None):
     return bins
 
 
+def _bins_per_column(X1, bins_info):
+    r"""
+    Calculate the number of bins of each column of X1 used to discretize
+    mutual information and variation of information. Returns None when
+    bins_info is 'HGR', because that method depends on each pair of columns.
+    """
+    n = X1.shape[1]
+
+    if bins_info == "HGR":
+        return None
+    elif isinstance(bins_info, np.int32) or isinstance(bins_info, int):
+        return np.full(n, bins_info, dtype=np.int32)
+
+    if bins_info == "KN":
+        bin_width = knuth_bin_width
+    elif bins_info == "FD":
+        bin_width = freedman_bin_width
+    elif bins_info == "SC":
+        bin_width = scott_bin_width
+
+    ranges = X1.max(axis=0) - X1.min(axis=0)
+    widths = np.array([bin_width(X1[:, i]) for i in range(n)])
+    bins_per_col = np.int32(np.round(ranges / widths))
+
+    return bins_per_col
+
+
+def _bin_indices(x, bins):
+    r"""
+    Get the bin of each value of x using the same equal width bins of
+    np.histogram and np.histogram2d.
+    """
+    first_edge, last_edge = x.min(), x.max()
+    if first_edge == last_edge:
+        first_edge, last_edge = first_edge - 0.5, last_edge + 0.5
+
+    edges = np.linspace(first_edge, last_edge, bins + 1)
+    idx = np.searchsorted(edges, x, side="right") - 1
+    idx[x == edges[-1]] -= 1  # last bin is closed on the right
+
+    return idx
+
+
+def _entropy(counts):
+    r"""
+    Calculate the entropy of a vector of counts.
+    """
+    p = counts[counts > 0] / counts.sum()
+
+    return -np.sum(p * np.log(p))
+
+
+def _entropy_matrices(X1, bins_info):
+    r"""
+    Calculate the entropies used by mutual information and variation of
+    information of each pair of columns of X1.
+
+    Returns three matrices of shape n_features x n_features, the marginal
+    entropy of the first and second column of each pair and their joint
+    entropy, all of them using the number of bins of the pair.
+    """
+    m = X1.shape[0]
+    n = X1.shape[1]
+    hX = np.zeros((n, n))
+    hY = np.zeros((n, n))
+    hXY = np.zeros((n, n))
+    indices = np.triu_indices(n)
+
+    bins_per_col = _bins_per_column(X1, bins_info)
+    if bins_info == "HGR":
+        C = np.atleast_2d(np.corrcoef(X1, rowvar=False))
+        np.fill_diagonal(C, 1)
+
+    marginals = {}  # bin indices and marginal entropies keyed on (column, bins)
+
+    for i, j in zip(indices[0], indices[1]):
+        if bins_per_col is not None:
+            bins = max(bins_per_col[i], bins_per_col[j])
+        else:
+            corr = C[i, j]
+            if corr == 1:
+                bins = numBins(m, None)
+            else:
+                bins = numBins(m, corr)
+
+        for col in (i, j):
+            if (col, bins) not in marginals:
+                idx = _bin_indices(X1[:, col], bins)
+                marginals[(col, bins)] = (idx, _entropy(np.bincount(idx)))
+
+        idx_i, hX[i, j] = marginals[(i, bins)]
+        idx_j, hY[i, j] = marginals[(j, bins)]
+        hXY[i, j] = _entropy(np.bincount(idx_i * bins + idx_j))  # joint
+
+        hX[j, i] = hY[i, j]
+        hY[j, i] = hX[i, j]
+        hXY[j, i] = hXY[i, j]
+
+    return hX, hY, hXY
+
+
+def _mi_vi_matrix(X, bins_info="KN", normalize=True):
+    r"""
+    Calculate the mutual information and variation of information matrices
+    of n variables from the same entropies. See mutual_info_matrix and
+    var_info_matrix for the description of the parameters.
+    """
+    flag = False
+    if isinstance(X, pd.DataFrame):
+        cols = X.columns.tolist()
+        X1 = X.to_numpy()
+        flag = True
+    else:
+        X1 = np.asarray(X)
+
+    hX, hY, hXY = _entropy_matrices(X1, bins_info)
+    iXY = hX + hY - hXY  # mutual information
+    vXY = hX + hY - 2 * iXY  # variation of information
+    if normalize == True:
+        iXY = iXY / np.minimum(hX, hY)  # normalized mutual information
+        vXY = vXY / hXY  # normalized variation of information
+
+    iXY = np.clip(np.round(iXY, 8), a_min=0.0, a_max=np.inf)
+    vXY = np.clip(np.round(vXY, 8), a_min=0.0, a_max=np.inf)
+
+    if flag:
+        iXY = pd.DataFrame(iXY, index=cols, columns=cols, copy=False)
+        vXY = pd.DataFrame(vXY, index=cols, columns=cols, copy=False)
+
+    return iXY, vXY
+
+
 def mutual_info_matrix(X, bins_info="KN", normalize=True):
     r"""
     Calculate the mutual information matrix of n variables.
@@ -446,66 +629,7 @@ def mutual_info_matrix(X, bins_info="KN", normalize=True):
         ValueError when the value cannot be calculated.
 
     """
-    flag = False
-    if isinstance(X, pd.DataFrame):
-        cols = X.columns.tolist()
-        X1 = X.to_numpy()
-        flag = True
-    else:
-        X1 = X.copy()
-
-    m = X1.shape[0]
-    n = X1.shape[1]
-    mat = np.zeros((n, n))
-    indices = np.triu_indices(n)
-
-    for i, j in zip(indices[0], indices[1]):
-        if bins_info == "KN":
-            k1 = (np.max(X1[:, i]) - np.min(X1[:, i])) / knuth_bin_width(X1[:, i])
-            bins = np.int32(np.round(k1))
-            if i != j:
-                k2 = (np.max(X1[:, j]) - np.min(X1[:, j])) / knuth_bin_width(X1[:, j])
-                bins = np.int32(np.round(np.maximum(k1, k2)))
-        elif bins_info == "FD":
-            k1 = (np.max(X1[:, i]) - np.min(X1[:, i])) / freedman_bin_width(X1[:, i])
-            bins = np.int32(np.round(k1))
-            if i != j:
-                k2 = (np.max(X1[:, j]) - np.min(X1[:, j])) / freedman_bin_width(
-                    X1[:, j]
-                )
-                bins = np.int32(np.round(np.maximum(k1, k2)))
-        elif bins_info == "SC":
-            k1 = (np.max(X1[:, i]) - np.min(X1[:, i])) / scott_bin_width(X1[:, i])
-            bins = np.int32(np.round(k1))
-            if i != j:
-                k2 = (np.max(X1[:, j]) - np.min(X1[:, j])) / scott_bin_width(X1[:, j])
-                bins = np.int32(np.round(np.maximum(k1, k2)))
-        elif bins_info == "HGR":
-            corr = np.corrcoef(X1[:, i], X1[:, j])[0, 1]
-            if corr == 1:
-                bins = numBins(m, None)
-            else:
-                bins = numBins(m, corr)
-        elif isinstance(bins_info, np.int32) or isinstance(bins_info, int):
-            bins = bins_info
-
-        cXY = np.histogram2d(X1[:, i], X1[:, j], bins)[0]
-        hX = st.entropy(np.histogram(X1[:, i], bins)[0])  # marginal
-        hY = st.entropy(np.histogram(X1[:, j], bins)[0])  # marginal
-        iXY = mutual_info_score(None, None, contingency=cXY)  # mutual information
-        if normalize == True:
-            iXY = iXY / np.min([hX, hY])  # normalized mutual information
-            # hXY = hX + hY - iXY # joint
-            # hX_Y = hXY - hY # conditional
-            # hY_X = hXY - hX # conditional
-
-        mat[i, j] = iXY
-        mat[j, i] = mat[i, j]
-
-    mat = np.clip(np.round(mat, 8), a_min=0.0, a_max=np.inf)
-
-    if flag:
-        mat = pd.DataFrame(mat, index=cols, columns=cols)
+    mat, _ = _mi_vi_matrix(X, bins_info, normalize)
 
     return mat
 
@@ -541,65 +665,7 @@ def var_info_matrix(X, bins_info="KN", normalize=True):
         ValueError when the value cannot be calculated.
 
     """
-    flag = False
-    if isinstance(X, pd.DataFrame):
-        cols = X.columns.tolist()
-        X1 = X.to_numpy()
-        flag = True
-    else:
-        X1 = X.copy()
-
-    m = X1.shape[0]
-    n = X1.shape[1]
-    mat = np.zeros((n, n))
-    indices = np.triu_indices(n)
-
-    for i, j in zip(indices[0], indices[1]):
-        if bins_info == "KN":
-            k1 = (np.max(X1[:, i]) - np.min(X1[:, i])) / knuth_bin_width(X1[:, i])
-            bins = np.int32(np.round(k1))
-            if i != j:
-                k2 = (np.max(X1[:, j]) - np.min(X1[:, j])) / knuth_bin_width(X1[:, j])
-                bins = np.int32(np.round(np.maximum(k1, k2)))
-        elif bins_info == "FD":
-            k1 = (np.max(X1[:, i]) - np.min(X1[:, i])) / freedman_bin_width(X1[:, i])
-            bins = np.int32(np.round(k1))
-            if i != j:
-                k2 = (np.max(X1[:, j]) - np.min(X1[:, j])) / freedman_bin_width(
-                    X1[:, j]
-                )
-                bins = np.int32(np.round(np.maximum(k1, k2)))
-        elif bins_info == "SC":
-            k1 = (np.max(X1[:, i]) - np.min(X1[:, i])) / scott_bin_width(X1[:, i])
-            bins = np.int32(np.round(k1))
-            if i != j:
-                k2 = (np.max(X1[:, j]) - np.min(X1[:, j])) / scott_bin_width(X1[:, j])
-                bins = np.int32(np.round(np.maximum(k1, k2)))
-        elif bins_info == "HGR":
-            corr = np.corrcoef(X1[:, i], X1[:, j])[0, 1]
-            if corr == 1:
-                bins = numBins(m, None)
-            else:
-                bins = numBins(m, corr)
-        elif isinstance(bins_info, np.int32) or isinstance(bins_info, int):
-            bins = bins_info
-
-        cXY = np.histogram2d(X1[:, i], X1[:, j], bins)[0]
-        hX = st.entropy(np.histogram(X1[:, i], bins)[0])  # marginal
-        hY = st.entropy(np.histogram(X1[:, j], bins)[0])  # marginal
-        iXY = mutual_info_score(None, None, contingency=cXY)  # mutual information
-        vXY = hX + hY - 2 * iXY  # variation of information
-        if normalize == True:
-            hXY = hX + hY - iXY  # joint
-            vXY = vXY / hXY  # normalized variation of information
-
-        mat[i, j] = vXY
-        mat[j, i] = mat[i, j]
-
-    mat = np.clip(np.round(mat, 8), a_min=0.0, a_max=np.inf)
-
-    if flag:
-        mat = pd.DataFrame(mat, index=cols, columns=cols)
+    _, mat = _mi_vi_matrix(X, bins_info, normalize)
 
     return mat
 
@@ -635,7 +701,7 @@ def ltdi_matrix(X, alpha=0.05):
         X1 = X.to_numpy()
         flag = True
     else:
-        X1 = X.copy()
+        X1 = np.asarray(X)
 
     m = X1.shape[0]
     n = X1.shape[1]
@@ -643,37 +709,31 @@ def ltdi_matrix(X, alpha=0.05):
     mat = np.ones((n, n))
 
     if k > 0:
-        indices = np.triu_indices(n)
-
-        for i, j in zip(indices[0], indices[1]):
-            u = np.sort(X1[:, i])[k - 1]
-            v = np.sort(X1[:, j])[k - 1]
-            ltd = (
-                np.sum(np.where(np.logical_and(X1[:, i] <= u, X1[:, j] <= v), 1, 0)) / k
-            )
-
-            mat[i, j] = ltd
-            mat[j, i] = mat[i, j]
-
-        for i in range(0, n):
-            u = np.sort(X1[:, i])[k - 1]
-            v = np.sort(X1[:, i])[k - 1]
-            ltd = (
-                np.sum(np.where(np.logical_and(X1[:, i] <= u, X1[:, i] <= v), 1, 0)) / k
-            )
-
-            mat[i, i] = ltd
+        # k-th smallest value of each column
+        u = np.partition(X1, k - 1, axis=0)[k - 1]
+        B = (X1 <= u).astype(np.float32, order="F")
+        mat = np.dot(B.T, B).astype(float) / k
 
     mat = np.clip(np.round(mat, 8), a_min=1.0e-8, a_max=1)
 
     if flag:
-        mat = pd.DataFrame(mat, index=cols, columns=cols)
-    else:
-        mat = pd.DataFrame(mat)
+        mat = pd.DataFrame(mat, index=cols, columns=cols, copy=False)
 
     return mat
 
 
+def _cluster_levels(clusters, n_levels):
+    r"""
+    Get the cluster labels of the first n_levels levels of a hierarchical
+    clustering as an array of shape n_features x n_levels, where column k
+    has k + 1 clusters, and the number of clusters of each level.
+    """
+    cluster_lvls = hr.cut_tree(clusters, n_clusters=np.arange(1, n_levels + 1))
+    k_per_level = cluster_lvls.max(axis=0) + 1
+
+    return cluster_lvls, k_per_level
+
+
 def two_diff_gap_stat(dist, clusters, max_k=10):
     r"""
     Calculate the optimal number of clusters based on the two difference gap
@@ -699,33 +759,32 @@ def two_diff_gap_stat(dist, clusters, max_k=10):
         ValueError when the value cannot be calculated.
 
     """
-    # cluster levels over from 1 to N-1 clusters
-    cluster_lvls = pd.DataFrame(hr.cut_tree(clusters), index=dist.columns)
-    num_k = cluster_lvls.columns  # save column with number of clusters
-    cluster_lvls = cluster_lvls.iloc[:, ::-1]  # reverse order to start with 1 cluster
-    cluster_lvls.columns = num_k  # set columns to number of cluster
+    # only the first limit_k levels are used by the gap statistic
+    n = dist.shape[0]
+    limit_k = int(min(max_k, np.sqrt(n)))
+
+    # cluster levels over from 1 to limit_k clusters
+    cluster_lvls, k_per_level = _cluster_levels(clusters, limit_k)
+    iu, ju = np.triu_indices(dist.shape[0], 1)
+    d_vec = np.asarray(dist)[iu, ju]  # pairwise distances
     W_list = []
 
     # get within-cluster dissimilarity for each k
-    for k in range(min(len(cluster_lvls.columns), max_k)):
-        level = cluster_lvls.iloc[:, k]  # get k clusters
-        D_list = []  # within-cluster distance list
-
-        for i in range(np.max(level.unique()) + 1):
-            cluster = level.loc[level == i]
-            # Based on correlation distance
-            cluster_dist = dist.loc[cluster.index, cluster.index]  # get distance
-            cluster_pdist = squareform(cluster_dist, checks=False)
-            if cluster_pdist.shape[0] != 0:
-                D = np.nan_to_num(cluster_pdist.mean())
-                D_list.append(D)  # append to list
+    for k in range(limit_k):
+        level = cluster_lvls[:, k]  # get k clusters
+        same = level[iu] == level[ju]  # pairs in the same cluster
+        labels = level[iu][same]
+
+        # Based on correlation distance, mean distance of each cluster
+        # with at least two members
+        counts = np.bincount(labels, minlength=k_per_level[k])
+        sums = np.bincount(labels, weights=d_vec[same], minlength=k_per_level[k])
+        D_list = np.nan_to_num(sums[counts > 0] / counts[counts > 0])
 
         W_k = np.sum(D_list)
         W_list.append(W_k)
 
     W_list = pd.Series(W_list)
-    n = dist.shape[0]
-    limit_k = int(min(max_k, np.sqrt(n)))
     gaps = W_list.shift(2) + W_list - 2 * W_list.shift(1)
     gaps = gaps[0:limit_k]
     if gaps.isna().all():
@@ -761,24 +820,29 @@ def std_silhouette_score(dist, clusters, max_k=10):
         ValueError when the value cannot be calculated.
 
     """
-    # cluster levels over from 1 to N-1 clusters
-    cluster_lvls = pd.DataFrame(hr.cut_tree(clusters), index=dist.columns)
-    num_k = cluster_lvls.columns  # save column with number of clusters
-    cluster_lvls = cluster_lvls.iloc[:, ::-1]  # reverse order to start with 1 cluster
-    cluster_lvls.columns = num_k  # set columns to number of cluster
+    # only the first limit_k scores are used, which start at level 2, and the
+    # silhouette score is only defined for levels with at most n - 1 clusters
+    n = dist.shape[0]
+    limit_k = int(min(max_k, np.sqrt(n)))
+    n_levels = min(n - 1, max_k, limit_k + 2)
+
+    # cluster levels over from 1 to n_levels clusters
+    cluster_lvls, _ = _cluster_levels(clusters, n_levels)
+    dist_ = np.array(dist, dtype=float)
+    np.fill_diagonal(dist_, 0)  # precomputed distances need a zero diagonal
     scores_list = []
 
     # get within-cluster dissimilarity for each k
-    for k in range(2, min(len(cluster_lvls.columns), max_k)):
-        level = cluster_lvls.iloc[:, k]  # get k clusters
-        b = silhouette_samples(dist, level)
+    for k in range(2, n_levels):
+        level = cluster_lvls[:, k]  # get k clusters
+        b = silhouette_samples(dist_, level, metric="precomputed")
         scores_list.append(b.mean() / b.std())
 
-    scores_list = pd.Series(scores_list)
-    n = dist.shape[0]
-    limit_k = int(min(max_k, np.sqrt(n)))
+    scores_list = pd.Series(scores_list, dtype=float)
     scores_list = scores_list[0:limit_k]
-    if scores_list.isna().all():
+    if scores_list.empty:
+        k = 1  # no level can be scored, so all assets are one cluster
+    elif scores_list.isna().all():
         k = len(scores_list)
     else:
         k = int(scores_list.idxmax() + 2)
@@ -786,6 +850,49 @@ def std_silhouette_score(dist, clusters, max_k=10):
     return k
 
 
+def _corr_matrix(returns, method="pearson"):
+    r"""
+    Calculate the pearson or spearman correlation matrix of returns with a
+    single matrix product of the centered and normalized returns (or their
+    ranks). Kendall correlation and returns with missing values use
+    DataFrame.corr, which handles pairwise missing values.
+    """
+    X = returns.to_numpy(dtype=float)
+    if method not in {"pearson", "spearman"} or np.isnan(X).any():
+        return returns.corr(method=method)
+
+    if method == "spearman":
+        X = st.rankdata(X, axis=0)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        Z = X - X.mean(axis=0)
+        Z /= np.sqrt(np.sum(Z**2, axis=0))  # constant columns give nan
+        corr = Z.T @ Z
+
+    np.clip(corr, a_min=-1.0, a_max=1.0, out=corr)
+    np.fill_diagonal(corr, np.where(np.isnan(np.diag(corr)), np.nan, 1.0))
+    corr = pd.DataFrame(corr, index=returns.columns, columns=returns.columns)
+
+    return corr
+
+
+def _codep_to_dist(codep, scale=0.5):
+    r"""
+    Calculate the distance matrix :math:`D_{i,j} = \sqrt{scale(1-\rho_{i,j})}`
+    of a codependence matrix, clipped to the interval [0, 1]. All the
+    operations are made in place on a single output array.
+    """
+    dist = np.subtract(1.0, np.asarray(codep, dtype=float))
+    dist *= scale
+    np.clip(dist, a_min=0.0, a_max=1.0, out=dist)
+    np.sqrt(dist, out=dist)
+
+    if isinstance(codep, pd.DataFrame):
+        dist = pd.DataFrame(dist, index=codep.index, columns=codep.columns)
+
+    return dist
+
+
 def codep_dist(
     returns,
     custom_cov=None,
@@ -850,31 +957,31 @@ def codep_dist(
 
     """
     if codependence in {"pearson", "spearman", "kendall"}:
-        codep = returns.corr(method=codependence)
-        dist = np.sqrt(np.clip((1 - codep) / 2, a_min=0.0, a_max=1.0))
+        codep = _corr_matrix(returns, method=codependence)
+        dist = _codep_to_dist(codep)
     elif codependence == "gerber1":
         codep = gs.gerber_cov_stat1(returns, threshold=gs_threshold)
         codep = cov2corr(codep)
-        dist = np.sqrt(np.clip((1 - codep) / 2, a_min=0.0, a_max=1.0))
+        dist = _codep_to_dist(codep)
     elif codependence == "gerber2":
         codep = gs.gerber_cov_stat2(returns, threshold=gs_threshold)
         codep = cov2corr(codep)
-        dist = np.sqrt(np.clip((1 - codep) / 2, a_min=0.0, a_max=1.0))
+        dist = _codep_to_dist(codep)
     elif codependence in {"abs_pearson", "abs_spearman", "abs_kendall"}:
-        codep = np.abs(returns.corr(method=codependence[4:]))
-        dist = np.sqrt(np.clip((1 - codep), a_min=0.0, a_max=1.0))
+        codep = np.abs(_corr_matrix(returns, method=codependence[4:]))
+        dist = _codep_to_dist(codep, scale=1.0)
     elif codependence in {"distance"}:
         codep = dcorr_matrix(returns).astype(float)
-        dist = np.sqrt(np.clip((1 - codep), a_min=0.0, a_max=1.0))
+        dist = _codep_to_dist(codep, scale=1.0)
     elif codependence in {"mutual_info"}:
-        codep = mutual_info_matrix(returns, bins_info).astype(float)
-        dist = var_info_matrix(returns, bins_info).astype(float)
+        codep, dist = _mi_vi_matrix(returns, bins_info)
+        codep, dist = codep.astype(float), dist.astype(float)
     elif codependence in {"tail"}:
         codep = ltdi_matrix(returns, alpha_tail).astype(float)
         dist = -np.log(codep)
     elif codependence in {"custom_cov"}:
         codep = cov2corr(custom_cov).astype(float)
-        dist = np.sqrt(np.clip((1 - codep) / 2, a_min=0.0, a_max=1.0))
+        dist = _codep_to_dist(codep)
 
     return codep, dist
 
@@ -884,6 +991,108 @@ def codep_dist(
 ###############################################################################
 
 
+_PDFArray = namedtuple("_PDFArray", ["x", "y"])
+
+
+def _fast_gaussian_kde(obs, bWidth, x):
+    r"""
+    Evaluates a gaussian KDE of obs on the points x. When x is a uniform grid
+    fine enough relative to the bandwidth, the obs are linearly binned on the
+    grid and convolved with the kernel using FFT, otherwise the kernel sum is
+    evaluated directly.
+    """
+
+    obs = np.asarray(obs, dtype=float).ravel()
+    x = np.asarray(x, dtype=float).ravel()
+    n, m = obs.shape[0], x.shape[0]
+    norm = n * bWidth * np.sqrt(2 * np.pi)
+
+    dx = (x[-1] - x[0]) / (m - 1) if m > 2 else 0
+    uniform = dx > 0 and np.allclose(np.diff(x), dx, rtol=1e-6, atol=0)
+
+    if uniform and dx <= bWidth / 10:
+        # Kernel is truncated where its value is below machine precision
+        k = int(np.ceil(8.5 * bWidth / dx))
+        t = (obs - x[0]) / dx + k
+        t = t[(t >= 0) & (t < m + 2 * k - 1)]
+        i = np.floor(t).astype(int)
+        w = t - i
+        counts = np.bincount(i, weights=1 - w, minlength=m + 2 * k)
+        counts += np.bincount(i + 1, weights=w, minlength=m + 2 * k)
+        kernel = np.exp(-0.5 * (np.arange(-k, k + 1) * dx / bWidth) ** 2)
+        pdf = fftconvolve(counts, kernel, mode="same")[k : k + m]
+        pdf = np.clip(pdf, 0, None) / norm
+    else:
+        pdf = np.empty(m)
+        step = max(1, 2**20 // max(n, 1))
+        for i in range(0, m, step):
+            z = (x[i : i + step, None] - obs[None, :]) / bWidth
+            pdf[i : i + step] = np.exp(-0.5 * z**2).sum(axis=1)
+        pdf /= norm
+
+    return pdf
+
+
+def _compact_kde(obs, bWidth, x, kernel="epanechnikov"):
+    r"""
+    Evaluates a tophat or epanechnikov KDE of obs on the points x. Both
+    kernels vanish beyond the bandwidth, so the kernel sums are obtained
+    from prefix sums of the sorted obs over the window of each point.
+    """
+
+    obs = np.sort(np.asarray(obs, dtype=float).ravel())
+    x = np.asarray(x, dtype=float).ravel()
+    n = obs.shape[0]
+
+    lo = np.searchsorted(obs, x - bWidth, side="right")
+    hi = np.searchsorted(obs, x + bWidth, side="left")
+    cnt = (hi - lo).astype(float)
+
+    if kernel == "tophat":
+        pdf = cnt / (2 * n * bWidth)
+    elif kernel == "epanechnikov":
+        # Sum of 1 - ((x - obs) / h) ** 2, obs are centered on their mean
+        # to reduce cancellation
+        z = obs - obs.mean()
+        s1 = np.r_[0, np.cumsum(z)]
+        s2 = np.r_[0, np.cumsum(z**2)]
+        s1 = s1[hi] - s1[lo]
+        s2 = s2[hi] - s2[lo]
+        xc = x - obs.mean()
+        pdf = cnt - (cnt * xc**2 - 2 * xc * s1 + s2) / bWidth**2
+        pdf = np.clip(pdf, 0, None) * 3 / (4 * n * bWidth)
+
+    return pdf
+
+
+def _fit_kde_raw(obs, bWidth=0.01, kernel="gaussian", x=None):
+    r"""
+    Same as fitKDE, but returns the points and the PDF as plain arrays.
+    """
+
+    obs = np.asarray(obs)
+    if len(obs.shape) == 1:
+        obs = obs.reshape(-1, 1)
+
+    if x is None:
+        x = np.unique(obs).reshape(-1, 1)
+
+    x = np.asarray(x)
+    if len(x.shape) == 1:
+        x = x.reshape(-1, 1)
+
+    if kernel == "gaussian":
+        pdf = _fast_gaussian_kde(obs, bWidth, x)
+    elif kernel in ["tophat", "epanechnikov"]:
+        pdf = _compact_kde(obs, bWidth, x, kernel=kernel)
+    else:
+        kde = KernelDensity(kernel=kernel, bandwidth=bWidth).fit(obs)
+        logProb = kde.score_samples(x)  # log(density)
+        pdf = np.exp(logProb)
+
+    return _PDFArray(x.flatten(), pdf)
+
+
 def fitKDE(obs, bWidth=0.01, kernel="gaussian", x=None):
     """
     Fit kernel to a series of obs, and derive the prob of obs x is the array of
@@ -921,21 +1130,29 @@ def fitKDE(obs, bWidth=0.01, kernel="gaussian", x=None):
 
     """
 
-    if len(obs.shape) == 1:
-        obs = obs.reshape(-1, 1)
+    pdf = _fit_kde_raw(obs, bWidth, kernel=kernel, x=x)
+    pdf = pd.Series(pdf.y, index=pdf.x)
 
-    kde = KernelDensity(kernel=kernel, bandwidth=bWidth).fit(obs)
+    return pdf
 
-    if x is None:
-        x = np.unique(obs).reshape(-1, 1)
 
-    if len(x.shape) == 1:
-        x = x.reshape(-1, 1)
+def _mp_pdf_raw(var, q, pts):
+    r"""
+    Same as mpPDF, but returns the grid and the PDF as plain arrays.
+    """
 
-    logProb = kde.score_samples(x)  # log(density)
-    pdf = pd.Series(np.exp(logProb), index=x.flatten())
+    if isinstance(var, np.ndarray):
+        if var.shape == (1,):
+            var = var[0]
 
-    return pdf
+    eMin, eMax = var * (1 - (1.0 / q) ** 0.5) ** 2, var * (1 + (1.0 / q) ** 0.5) ** 2
+    eVal = np.linspace(eMin, eMax, pts)
+    pdf = (eMax - eVal) * (eVal - eMin)
+    np.sqrt(pdf, out=pdf)
+    pdf /= eVal
+    pdf *= q / (2 * np.pi * var)
+
+    return _PDFArray(eVal, pdf)
 
 
 def mpPDF(var, q, pts):
@@ -963,14 +1180,8 @@ def mpPDF(var, q, pts):
 
     """
 
-    if isinstance(var, np.ndarray):
-        if var.shape == (1,):
-            var = var[0]
-
-    eMin, eMax = var * (1 - (1.0 / q) ** 0.5) ** 2, var * (1 + (1.0 / q) ** 0.5) ** 2
-    eVal = np.linspace(eMin, eMax, pts)
-    pdf = q / (2 * np.pi * var * eVal) * ((eMax - eVal) * (eVal - eMin)) ** 0.5
-    pdf = pd.Series(pdf, index=eVal)
+    pdf = _mp_pdf_raw(var, q, pts)
+    pdf = pd.Series(pdf.y, index=pdf.x)
 
     return pdf
 
@@ -1004,13 +1215,56 @@ def errPDFs(var, eVal, q, bWidth=0.01, pts=1000):
     """
 
     # Fit error
-    pdf0 = mpPDF(var, q, pts)  # theoretical pdf
-    pdf1 = fitKDE(eVal, bWidth, x=pdf0.index.values)  # empirical pdf
-    sse = np.sum((pdf1 - pdf0) ** 2)
+    pdf0 = _mp_pdf_raw(var, q, pts)  # theoretical pdf
+    pdf1 = _fit_kde_raw(eVal, bWidth, x=pdf0.x)  # empirical pdf
+    sse = np.sum((pdf1.y - pdf0.y) ** 2)
 
     return sse
 
 
+@lru_cache(maxsize=32)
+def _mp_unit_pdf(q, pts):
+    r"""
+    Grid and values of the Marchenko-Pastur PDF of unit variance. They are
+    cached because denoising studies call findMaxEval many times with the
+    same q and pts, the returned arrays are read only.
+    """
+
+    grid, pdf = _mp_pdf_raw(1.0, q, pts)
+    grid.setflags(write=False)
+    pdf.setflags(write=False)
+
+    return grid, pdf
+
+
+class _MPFitter:
+    r"""
+    Sum squared error between the empirical PDF of eVal and the
+    Marchenko-Pastur PDF as a function of the variance, used by findMaxEval.
+    Everything that does not depend on the variance is computed once.
+    """
+
+    def __init__(self, eVal, q, bWidth=0.01, pts=1000):
+        # The Marchenko-Pastur PDF of variance var is the PDF of unit variance
+        # scaled by var, so the grid and the theoretical PDF are computed once
+        self._grid, self._pdf0 = _mp_unit_pdf(float(q), int(pts))
+
+        # The empirical PDF is fitted once on a fine grid that covers the
+        # support of every var in (0, 1) and then interpolated on each iterate
+        self._x = np.linspace(0, self._grid[-1], 10 * pts)
+        self._pdf1 = _fit_kde_raw(eVal, bWidth, x=self._x).y
+
+        self._xv = np.empty(pts)
+        self._err = np.empty(pts)
+
+    def __call__(self, var):
+        np.multiply(self._grid, var, out=self._xv)
+        np.divide(self._pdf0, var, out=self._err)
+        np.subtract(np.interp(self._xv, self._x, self._pdf1), self._err, out=self._err)
+
+        return np.dot(self._err, self._err)
+
+
 def findMaxEval(eVal, q, bWidth=0.01):
     r"""
     Find max random eVal by fitting Marchenko’s dist (i.e) everything else
@@ -1037,20 +1291,47 @@ def findMaxEval(eVal, q, bWidth=0.01):
         ValueError when the value cannot be calculated.
     """
 
-    out = minimize(
-        lambda *x: errPDFs(*x), 0.5, args=(eVal, q, bWidth), bounds=((1e-5, 1 - 1e-5),)
+    sse = _MPFitter(eVal, q, bWidth)
+
+    # The error is not unimodal in var, so a coarse grid locates the basin of
+    # the global minimum and the bounded solver refines it inside its bracket
+    grid = np.linspace(1e-5, 1 - 1e-5, 100)
+    errs = np.array([sse(v) for v in grid])
+    i = int(np.argmin(errs))
+    bounds = (grid[max(i - 1, 0)], grid[min(i + 1, len(grid) - 1)])
+    out = minimize_scalar(
+        sse, bounds=bounds, method="bounded", options={"xatol": 1e-5}
     )
 
-    if out["success"]:
-        var = out["x"][0]
+    if out["success"] and out["fun"] <= errs[i]:
+        var = out["x"]
     else:
-        var = 1
+        var = grid[i]
 
     eMax = var * (1 + (1.0 / q) ** 0.5) ** 2
 
     return eMax, var
 
 
+def _eigh_direct(matrix):
+    r"""
+    Closed form eigendecomposition of a symmetric matrix of size 1 or 2.
+    Eigenvalues are returned in ascending order like np.linalg.eigh.
+    """
+
+    if matrix.shape[0] == 1:
+        return np.array([float(matrix[0, 0])]), np.ones((1, 1))
+
+    a, b, d = float(matrix[0, 0]), float(matrix[0, 1]), float(matrix[1, 1])
+    mid, rad = (a + d) / 2, math.hypot((a - d) / 2, b)
+    theta = math.atan2(2 * b, a - d) / 2
+    c, s = math.cos(theta), math.sin(theta)
+    eVal = np.array([mid - rad, mid + rad])
+    eVec = np.array([[-s, c], [c, s]])
+
+    return eVal, eVec
+
+
 def getPCA(matrix):
     r"""
     Gets the Eigenvalues and Eigenvector values from a Hermitian Matrix.
@@ -1059,13 +1340,16 @@ def getPCA(matrix):
     Parameters
     ----------
     matrix : ndarray or pd.DataFrame
-        Correlation matrix.
+        Correlation matrix, or a stack of correlation matrices of the same
+        size with shape n_matrices x n_features x n_features, whose
+        eigendecompositions are calculated in one batched call.
 
     Returns
     -------
-    pdf : tuple (float, float)
-       First value are the eigenvalues of correlation matrix and second are
-       the Eigenvectors of correlation matrix.
+    pdf : tuple (ndarray, ndarray)
+       First value are the eigenvalues of correlation matrix in descending
+       order and second are the Eigenvectors of correlation matrix. For a
+       stack of matrices both values are stacked along the first axis.
 
     Raises
     ------
@@ -1073,10 +1357,14 @@ def getPCA(matrix):
     """
 
     # Get eVal,eVec from a Hermitian matrix
-    eVal, eVec = np.linalg.eigh(matrix)
-    indices = eVal.argsort()[::-1]  # arguments for sorting eVal desc
-    eVal, eVec = eVal[indices], eVec[:, indices]
-    eVal = np.diagflat(eVal)
+    matrix = np.asarray(matrix)
+    if matrix.ndim == 2 and matrix.shape[0] <= 2 and np.isrealobj(matrix):
+        eVal, eVec = _eigh_direct(matrix)
+    else:
+        eVal, eVec = np.linalg.eigh(matrix)
+    indices = eVal.argsort(axis=-1)[..., ::-1]  # arguments for sorting eVal desc
+    eVal = np.take_along_axis(eVal, indices, axis=-1)
+    eVec = np.take_along_axis(eVec, indices[..., None, :], axis=-1)
 
     return eVal, eVec
 
@@ -1089,8 +1377,8 @@ def denoisedCorr(eVal, eVec, nFacts, kind="fixed"):
     Parameters
     ----------
     eVal : 1darray
-        Eigenvalues.
-    eVal : ndarray
+        Eigenvalues in descending order.
+    eVec : ndarray
         Eigenvectors.
     nFacts : float
         The number of factors.
@@ -1110,16 +1398,24 @@ def denoisedCorr(eVal, eVec, nFacts, kind="fixed"):
         ValueError when the value cannot be calculated.
     """
 
-    eVal_ = np.diag(eVal).copy()
+    eVal_ = np.array(eVal, dtype=np.result_type(eVec, np.float32))
+    if eVal_.ndim == 2:
+        eVal_ = np.diag(eVal_).copy()
 
     if kind == "fixed":
         eVal_[nFacts:] = eVal_[nFacts:].sum() / float(eVal_.shape[0] - nFacts)
     elif kind == "spectral":
         eVal_[nFacts:] = 0
 
-    eVal_ = np.diag(eVal_)
-    corr = np.dot(eVec, eVal_).dot(eVec.T)
-    corr = cov2corr(corr)
+    corr = np.dot(eVec * eVal_, eVec.T)
+
+    # Rescale in place to unit diagonal, skipped when it is already one
+    d = np.sqrt(np.diag(corr))
+    if not np.allclose(d, 1, rtol=0, atol=1e-10):
+        corr /= d[:, None]
+        corr /= d[None, :]
+    np.clip(corr, a_min=-1.0, a_max=1.0, out=corr)
+    np.fill_diagonal(corr, 1.0)
 
     return corr
 
@@ -1132,8 +1428,8 @@ def shrinkCorr(eVal, eVec, nFacts, alpha=0):
     Parameters
     ----------
     eVal : 1darray
-        Eigenvalues.
-    eVal : ndarray
+        Eigenvalues in descending order.
+    eVec : ndarray
         Eigenvectors.
     nFacts : float
         The number of factors.
@@ -1150,18 +1446,30 @@ def shrinkCorr(eVal, eVec, nFacts, alpha=0):
         ValueError when the value cannot be calculated.
     """
 
-    eVal_L = eVal[:nFacts, :nFacts]
+    eVal_ = np.asarray(eVal)
+    if eVal_.ndim == 2:
+        eVal_ = np.diag(eVal_)
+
     eVec_L = eVec[:, :nFacts]
-    eVal_R = eVal[nFacts:, nFacts:]
     eVec_R = eVec[:, nFacts:]
-    corr0 = np.dot(eVec_L, eVal_L).dot(eVec_L.T)
-    corr1 = np.dot(eVec_R, eVal_R).dot(eVec_R.T)
-    corr2 = corr0 + alpha * corr1 + (1 - alpha) * np.diag(np.diag(corr1))
+    corr0 = np.dot(eVec_L * eVal_[:nFacts], eVec_L.T)
+    corr1 = np.dot(eVec_R * eVal_[nFacts:], eVec_R.T)
+    corr2 = corr0 + alpha * corr1
+    corr2[np.diag_indices_from(corr2)] += (1 - alpha) * np.diag(corr1)
 
     return corr2
 
 
-def denoiseCov(cov, q, kind="fixed", bWidth=0.01, detone=False, mkt_comp=1, alpha=0):
+def denoiseCov(
+    cov,
+    q,
+    kind="fixed",
+    bWidth=0.01,
+    detone=False,
+    mkt_comp=1,
+    alpha=0,
+    dtype=np.float64,
+):
     r"""
     Remove noise from cov by fixing random eigenvalues of their correlation
     matrix. For more information see chapter 2 of :cite:`d-MLforAM`.
@@ -1189,6 +1497,11 @@ def denoiseCov(cov, q, kind="fixed", bWidth=0.01, detone=False, mkt_comp=1, alph
         Number of first components that will be removed using the detone method.
     alpha : float, optional
         Shrinkage factor.
+    dtype : data-type, optional
+        Floating point type used to calculate the eigendecomposition and the
+        denoised correlation matrix. np.float32 is faster for large matrices
+        but less precise, the denoised covariance is always returned in
+        np.float64. The default value is np.float64.
 
     Returns
     -------
@@ -1205,11 +1518,13 @@ def denoiseCov(cov, q, kind="fixed", bWidth=0.01, detone=False, mkt_comp=1, alph
         cols = cov.columns.tolist()
         flag = True
 
-    corr = cov2corr(cov)
-    std = np.diag(cov) ** 0.5
+    cov_ = np.array(cov, ndmin=2, dtype=float)
+    std = np.diag(cov_) ** 0.5
+    cov_ = cov_.astype(dtype, copy=False)
+    corr = _cov2corr_inplace(cov_, out=cov_)
     eVal, eVec = getPCA(corr)
-    eMax, var = findMaxEval(np.diag(eVal), q, bWidth)
-    nFacts = eVal.shape[0] - np.diag(eVal)[::-1].searchsorted(eMax)
+    eMax, var = findMaxEval(eVal, q, bWidth)
+    nFacts = int(np.count_nonzero(eVal >= eMax))
 
     if kind in ["fixed", "spectral"]:
         corr = denoisedCorr(eVal, eVec, nFacts, kind=kind)
@@ -1217,12 +1532,11 @@ def denoiseCov(cov, q, kind="fixed", bWidth=0.01, detone=False, mkt_comp=1, alph
         corr = shrinkCorr(eVal, eVec, nFacts, alpha=alpha)
 
     if detone == True:
-        eVal_ = eVal[:mkt_comp, :mkt_comp]
         eVec_ = eVec[:, :mkt_comp]
-        corr_ = np.dot(eVec_, eVal_).dot(eVec_.T)
-        corr = corr - corr_
+        corr -= np.dot(eVec_ * eVal[:mkt_comp], eVec_.T)
 
-    cov_ = corr2cov(corr, std)
+    corr = np.asarray(corr, dtype=float)
+    cov_ = _corr2cov_inplace(corr, std, out=corr)
 
     if flag:
         cov_ = pd.DataFrame(cov_, index=cols, columns=cols)
@@ -1261,18 +1575,11 @@ def round_values(data, decimals=4, wider=False):
 
     """
 
+    value = np.asarray(data)
     if wider == True:
-        value = np.where(
-            data >= 0,
-            np.ceil(data * 10**decimals) / 10**decimals,
-            np.floor(data * 10**decimals) / 10**decimals,
-        )
+        value = np.sign(value) * np.ceil(np.abs(value) * 10**decimals) / 10**decimals
     elif wider == False:
-        value = np.where(
-            data >= 0,
-            np.floor(data * 10**decimals) / 10**decimals,
-            np.ceil(data * 10**decimals) / 10**decimals,
-        )
+        value = np.trunc(value * 10**decimals) / 10**decimals
 
     if isinstance(data, pd.DataFrame):
         value = pd.DataFrame(value, columns=data.columns, index=data.index)
@@ -1347,51 +1654,55 @@ def weights_discretizetion(
     w.columns = [0]
     p.columns = [0]
 
-    total = w.sum().item()
-    w = round_values(w, decimals=w_decimal, wider=False)
-    w.loc[w.idxmin().tolist()] = w.loc[w.idxmin().tolist()] + (total - w.sum()).item()
+    missing = w.index.difference(p.index)
+    if len(missing) > 0:
+        raise ValueError("prices are missing for assets: " + str(missing.tolist()))
+    p = p.loc[w.index]
+
+    w_ = w.to_numpy(dtype=float).ravel()
+    p_ = p.to_numpy(dtype=float).ravel()
 
-    n_shares = round_values(capital * w / p, decimals=0, wider=False)
+    total = w_.sum()
+    w_ = round_values(w_, decimals=w_decimal, wider=False)
+    w_[np.argmin(w_)] += total - w_.sum()
+    w.iloc[:, 0] = w_
+
+    n_shares_ = np.trunc(capital * w_ / p_)
 
     excedent = [capital + 1, capital]
     i = 1
     while excedent[i] < excedent[i - 1]:
-        new_capital = (n_shares.T @ p).iloc[0, 0]
+        new_capital = n_shares_ @ p_
         excedent.append(capital - new_capital)
-        new_shares = round_values(excedent[-1] * w / p, 0)
-        n_shares += new_shares
+        n_shares_ += np.trunc(excedent[-1] * w_ / p_)
         i += 1
 
-    n_shares_1 = capital * w / p
+    n_shares_1 = capital * w_ / p_
 
-    excedent = capital - (n_shares.T @ p).iloc[0, 0]
-    i = 1
+    d_shares = np.abs(n_shares_1) - np.abs(n_shares_)
+    d_shares = np.where(d_shares > 0, n_shares_1 - n_shares_, 0)
+    d_shares = np.sign(d_shares) * np.ceil(np.abs(d_shares))
 
-    d_shares = np.abs(n_shares_1) - np.abs(n_shares)
-    d_shares = np.where(d_shares > 0, n_shares_1 - n_shares, 0)
-    d_shares = round_values(d_shares, decimals=0, wider=True)
-    d_shares = pd.DataFrame(d_shares, columns=w.columns, index=w.index)
+    excedent = capital - n_shares_ @ p_
 
-    n_shares_1 = capital * w / p
+    order = w.reset_index(drop=True).sort_values(by=0, ascending=ascending).index
+    order = order[d_shares[order] == 1]
 
-    excedent = capital - (n_shares.T @ p).iloc[0, 0]
+    for i in order:
+        new_shares = np.trunc(excedent / p_[i])
+        if new_shares > 0:
+            n_shares_[i] += new_shares
+            excedent = capital - n_shares_ @ p_
 
-    d_shares = np.abs(n_shares_1) - np.abs(n_shares)
-    d_shares = np.where(d_shares > 0, n_shares_1 - n_shares, 0)
-    d_shares = round_values(d_shares, decimals=0, wider=True)
-    d_shares = pd.DataFrame(d_shares, columns=w.columns, index=w.index)
+    n_shares = pd.DataFrame(n_shares_, columns=w.columns, index=w.index)
 
-    order = w.sort_values(by=0, ascending=ascending).index.tolist()
-    d_list = d_shares[d_shares[0] == 1].index.tolist()
+    return n_shares
 
-    for i in order:
-        if i in d_list:
-            new_shares = round_values(excedent / p.loc[i, 0], 0).item()
-            if new_shares > 0:
-                n_shares.loc[i] += new_shares
-                excedent = capital - (n_shares.T @ p).iloc[0, 0]
 
-    return n_shares
+_TAB10 = [mpl.colors.rgb2hex(c) for c in plt.get_cmap("tab10").colors]
+_TAB20 = [mpl.colors.rgb2hex(c) for c in plt.get_cmap("tab20").colors]
+_TAB20B = [mpl.colors.rgb2hex(c) for c in plt.get_cmap("tab20b").colors]
+_TAB20C = [mpl.colors.rgb2hex(c) for c in plt.get_cmap("tab20c").colors]
 
 
 def color_list(k):
@@ -1409,26 +1720,14 @@ def color_list(k):
         A list of colors.
     """
 
-    colors = []
-
     if k <= 10:
-        for i in range(10):
-            colors.append(mpl.colors.rgb2hex(plt.get_cmap("tab10").colors[i]))
+        colors = _TAB10[:]
     elif k <= 20:
-        for i in range(20):
-            colors.append(mpl.colors.rgb2hex(plt.get_cmap("tab20").colors[i]))
+        colors = _TAB20[:]
     elif k <= 40:
-        for i in range(20):
-            colors.append(mpl.colors.rgb2hex(plt.get_cmap("tab20").colors[i]))
-        for i in range(20):
-            colors.append(mpl.colors.rgb2hex(plt.get_cmap("tab20b").colors[i]))
+        colors = _TAB20 + _TAB20B
     else:
-        for i in range(20):
-            colors.append(mpl.colors.rgb2hex(plt.get_cmap("tab20").colors[i]))
-        for i in range(20):
-            colors.append(mpl.colors.rgb2hex(plt.get_cmap("tab20b").colors[i]))
-        for i in range(20):
-            colors.append(mpl.colors.rgb2hex(plt.get_cmap("tab20c").colors[i]))
+        colors = _TAB20 + _TAB20B + _TAB20C
         if k / 60 > 1:
             colors = colors * int(np.ceil(k / 60))
 
@@ -111,7 +111,8 @@ if __name__ == "__main__":
         external_module = Pybind11Extension('riskfolio.external.functions',
             sources=sources,
             include_dirs = [numpy_include, eigen_path, eigen_core_path, eigen_unsupported_path, spectra_path, external_path,external_path],
-            extra_compile_args = ['-O2', '-Ofast'],
+            extra_compile_args = ['-O2', '-Ofast', '-pthread'],
+            extra_link_args = ['-pthread'],
             define_macros = [('VERSION_INFO', VERSION)],
             )
 
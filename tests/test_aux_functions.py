@@ -0,0 +1,223 @@
+""""""  #
+"""
+Copyright (c) 2020-2024, Dany Cajas
+All rights reserved.
+This work is licensed under BSD 3-Clause "New" or "Revised" License.
+License available at https://github.com/dcajasn/Riskfolio-Lib/blob/master/LICENSE.txt
+"""
+
+import os
+import numpy as np
+import pandas as pd
+import pytest
+import scipy.cluster.hierarchy as hr
+from sklearn.metrics import silhouette_samples
+from scipy.spatial.distance import squareform
+import riskfolio as rp
+import riskfolio.external.cppfunctions as cf
+
+
+def resource(name):
+    return os.path.join(os.path.abspath(os.path.dirname(__file__)), name)
+
+
+def get_data(name):
+    return pd.read_csv(resource(name), parse_dates=True, index_col=0)
+
+
+def test_weights_discretizetion_price_order():
+
+    assets = ["A", "B", "C", "D", "E"]
+    weights = pd.Series([0.30, 0.25, 0.20, 0.15, 0.10], index=assets)
+    prices = pd.DataFrame([[10, 200, 35, 7, 90]], columns=assets)
+
+    n_shares = rp.weights_discretizetion(weights, prices, capital=10000)
+    n_shares_1 = rp.weights_discretizetion(
+        weights, prices[["E", "C", "A", "D", "B"]], capital=10000
+    )
+
+    np.testing.assert_array_equal(n_shares.index, assets)
+    np.testing.assert_array_equal(n_shares[0], [307, 12, 57, 217, 11])
+    np.testing.assert_array_equal(n_shares_1.index, assets)
+    np.testing.assert_array_equal(n_shares_1[0], [307, 12, 57, 217, 11])
+
+    with pytest.raises(ValueError):
+        rp.weights_discretizetion(weights, prices[["A", "B", "C"]], capital=10000)
+
+
+def test_mutual_info_matrix_single_column():
+
+    X = np.random.RandomState(0).standard_normal((200, 1))
+
+    for bins_info in ["KN", "FD", "SC", "HGR"]:
+        np.testing.assert_array_almost_equal(
+            rp.mutual_info_matrix(X, bins_info=bins_info), [[1.0]]
+        )
+        np.testing.assert_array_almost_equal(
+            rp.var_info_matrix(X, bins_info=bins_info), [[0.0]]
+        )
+
+
+def get_clustering(n, seed=0):
+
+    X = np.random.RandomState(seed).standard_normal((100, n))
+    dist = np.sqrt(np.clip((1 - np.corrcoef(X, rowvar=False)) / 2, 0, None))
+    np.fill_diagonal(dist, 0)
+    clustering = hr.linkage(squareform(dist, checks=False), method="ward")
+
+    return pd.DataFrame(dist), clustering
+
+
+def test_std_silhouette_score_small_samples():
+
+    for n in range(2, 7):
+        dist, clustering = get_clustering(n)
+        for max_k in [2, 3, 5, 10]:
+            k = rp.std_silhouette_score(dist, clustering, max_k)
+            assert 1 <= k <= max(n - 1, 1)
+
+    dist, clustering = get_clustering(3)
+    assert rp.std_silhouette_score(dist, clustering, 10) == 1
+
+
+def dcorr_reference(x, y):
+
+    x = x.reshape(len(x), -1)
+    y = y.reshape(len(y), -1)
+    a = np.linalg.norm(x[:, None, :] - x[None, :, :], axis=2)
+    b = np.linalg.norm(y[:, None, :] - y[None, :, :], axis=2)
+    A = a - a.mean(axis=0) - a.mean(axis=1)[:, None] + a.mean()
+    B = b - b.mean(axis=0) - b.mean(axis=1)[:, None] + b.mean()
+    dcov2_xy = (A * B).mean()
+    dcov2_xx = (A * A).mean()
+    dcov2_yy = (B * B).mean()
+
+    return np.sqrt(dcov2_xy / np.sqrt(dcov2_xx * dcov2_yy))
+
+
+def test_dcorr_matrix():
+
+    X = np.random.RandomState(0).standard_normal((60, 5))
+    X[:, 1] = np.round(X[:, 1])  # ties
+    X[:, 3] = X[:, 0] ** 2  # nonlinear dependence
+    n = X.shape[1]
+
+    ref = np.array(
+        [[dcorr_reference(X[:, i], X[:, j]) for j in range(n)] for i in range(n)]
+    )
+
+    for n_threads in [1, 3]:
+        np.testing.assert_array_almost_equal(
+            cf.d_corr_matrix(X, n_threads=n_threads), ref, decimal=10
+        )
+    np.testing.assert_array_almost_equal(rp.dcorr_matrix(X), ref, decimal=10)
+    np.testing.assert_almost_equal(
+        cf.d_corr(X[:, [0]], X[:, [3]]), ref[0, 3], decimal=10
+    )
+    np.testing.assert_almost_equal(
+        cf.d_corr(X[:, :2], X[:, 2:]),
+        dcorr_reference(X[:, :2], X[:, 2:]),
+        decimal=10,
+    )
+
+    # a constant column has no distance correlation with the rest
+    X[:, 4] = 2.0
+    for n_threads in [1, 3]:
+        mat = cf.d_corr_matrix(X, n_threads=n_threads)
+        assert np.isnan(mat[4, :4]).all() and np.isnan(mat[:4, 4]).all()
+        np.testing.assert_array_almost_equal(mat[:4, :4], ref[:4, :4], decimal=10)
+
+
+def test_std_silhouette_score_precomputed():
+
+    # silhouettes are calculated from the distance matrix itself, not from
+    # euclidean distances between its rows
+    dist, clustering = get_clustering(30, seed=8)
+    levels = hr.cut_tree(clustering)[:, ::-1]  # column k has k + 1 clusters
+
+    for max_k in [5, 10]:
+        limit_k = int(min(max_k, np.sqrt(30)))
+        scores = []
+        for k in range(2, min(30, max_k)):
+            b = silhouette_samples(dist.to_numpy(), levels[:, k], metric="precomputed")
+            scores.append(b.mean() / b.std())
+        k = int(np.argmax(scores[:limit_k]) + 2)
+
+        assert k == 3
+        assert rp.std_silhouette_score(dist, clustering, max_k) == k
+
+
+def test_codependence_matrices_return_types():
+
+    X = np.random.RandomState(0).standard_normal((100, 4))
+    assets = ["A", "B", "C", "D"]
+    Y = pd.DataFrame(X, columns=assets)
+
+    functions = [
+        rp.mutual_info_matrix,
+        rp.var_info_matrix,
+        rp.ltdi_matrix,
+        rp.dcorr_matrix,
+    ]
+
+    for f in functions:
+        mat = f(X)
+        mat_1 = f(Y)
+        assert isinstance(mat, np.ndarray) and mat.shape == (4, 4)
+        assert isinstance(mat_1, pd.DataFrame)
+        np.testing.assert_array_equal(mat_1.index, assets)
+        np.testing.assert_array_equal(mat_1.columns, assets)
+        np.testing.assert_array_almost_equal(mat_1.to_numpy(), mat)
+
+
+def test_find_max_eval_best_fit():
+
+    cases = []
+    for seed in range(4):
+        rs = np.random.RandomState(seed)
+        T, N, k = [(500, 100, 3), (120, 40, 1), (300, 15, 2), (80, 60, 4)][seed]
+        F = rs.standard_normal((T, k))
+        X = F @ rs.standard_normal((k, N)) * 0.5 + rs.standard_normal((T, N))
+        cases.append((X, T / N))
+
+    assets = ["JCI", "TGT", "CMCSA", "CPB", "MO", "AMZN", "APA", "MMC", "JPM", "ZION"]
+    assets.sort()
+    Y = get_data("stock_prices.csv")
+    Y = Y[assets].pct_change().dropna().iloc[-200:]
+    cases.append((Y.to_numpy(), 200 / 10))
+
+    # the error is not unimodal in var, the fitted variance must be as good
+    # as the best one on a fine grid, including the bounds
+    grid = np.linspace(1e-5, 1 - 1e-5, 100)
+    for X, q in cases:
+        eVal, _ = rp.getPCA(np.corrcoef(X, rowvar=False))
+        eMax, var = rp.findMaxEval(eVal, q)
+        sse = np.array([rp.errPDFs(v, eVal, q) for v in grid])
+        assert rp.errPDFs(var, eVal, q) <= sse.min() * 1.001
+        np.testing.assert_almost_equal(eMax, var * (1 + (1.0 / q) ** 0.5) ** 2)
+
+    # for these returns the best fit is at the upper bound
+    assert var > 0.999
+
+
+def test_get_pca_small_matrices():
+
+    rs = np.random.RandomState(0)
+    matrices = [np.array([[2.5]]), np.eye(2), np.diag([1.0, 3.0]), np.diag([3.0, 1.0])]
+    for n in [1, 2, 2, 2, 2]:
+        A = rs.standard_normal((n, n))
+        matrices.append(A + A.T)
+
+    for matrix in matrices:
+        eVal, eVec = rp.getPCA(matrix)
+        np.testing.assert_array_almost_equal(
+            eVal, np.sort(np.linalg.eigvalsh(matrix))[::-1]
+        )
+        np.testing.assert_array_almost_equal(eVec @ np.diag(eVal) @ eVec.T, matrix)
+        np.testing.assert_array_almost_equal(eVec.T @ eVec, np.eye(len(matrix)))
+
+    # complex Hermitian matrices are not truncated to their real part
+    matrix = np.array([[2, 1j], [-1j, 2]])
+    eVal, eVec = rp.getPCA(matrix)
+    np.testing.assert_array_almost_equal(eVal, [3, 1])
+    np.testing.assert_array_almost_equal(eVec @ np.diag(eVal) @ eVec.conj().T, matrix)